@@ -1,8 +1,10 @@
 from typing import Union
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from supabase_init import supabase
+from agent.tools import UserContext
+from dataclasses import asdict
 from dotenv import load_dotenv
 import json
 import os
@@ -20,7 +22,77 @@ openai_client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
 yelp_api_key = os.environ.get("YELP_API_KEY")
 
 
-def call_yelp_ai(query: str, chat_id: str = None) -> dict:
+# Geohash precision 6 is a ~1.2km x 0.6km cell, fine enough for local search
+# while letting nearby users share the same Yelp user_context
+GEOHASH_PRECISION = 6
+GEOHASH_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def encode_geohash(latitude: float, longitude: float, precision: int = GEOHASH_PRECISION) -> str:
+    """Encode coordinates as a geohash string of the given precision"""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    geohash = []
+    bits = 0
+    bit_count = 0
+    even_bit = True
+
+    while len(geohash) < precision:
+        if even_bit:
+            value, interval = longitude, lon_range
+        else:
+            value, interval = latitude, lat_range
+        mid = (interval[0] + interval[1]) / 2
+        bits <<= 1
+        if value >= mid:
+            bits |= 1
+            interval[0] = mid
+        else:
+            interval[1] = mid
+        even_bit = not even_bit
+
+        bit_count += 1
+        if bit_count == 5:
+            geohash.append(GEOHASH_BASE32[bits])
+            bits = 0
+            bit_count = 0
+
+    return "".join(geohash)
+
+
+def decode_geohash(geohash: str) -> tuple[float, float]:
+    """Decode a geohash string to the (latitude, longitude) of its cell center"""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    even_bit = True
+
+    for char in geohash:
+        index = GEOHASH_BASE32.index(char)
+        for shift in range(4, -1, -1):
+            interval = lon_range if even_bit else lat_range
+            mid = (interval[0] + interval[1]) / 2
+            if (index >> shift) & 1:
+                interval[0] = mid
+            else:
+                interval[1] = mid
+            even_bit = not even_bit
+
+    return (lat_range[0] + lat_range[1]) / 2, (lon_range[0] + lon_range[1]) / 2
+
+
+def build_user_context(latitude: float = None, longitude: float = None) -> dict:
+    """Build a Yelp user_context with coordinates snapped to their geohash cell center"""
+    if latitude is None or longitude is None:
+        return {}
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return {}
+
+    snapped_latitude, snapped_longitude = decode_geohash(
+        encode_geohash(latitude, longitude))
+    return asdict(UserContext(snapped_latitude, snapped_longitude))
+
+
+def call_yelp_ai(query: str, chat_id: str = None, latitude: float = None, longitude: float = None) -> dict:
     """Call Yelp AI Chat API v2 (synchronous)"""
     url = "https://api.yelp.com/ai/chat/v2"
     headers = {
@@ -30,7 +102,7 @@ def call_yelp_ai(query: str, chat_id: str = None) -> dict:
     data = {
         "query": query,
         "chat_id": chat_id if chat_id else "",
-        "user_context": {}
+        "user_context": build_user_context(latitude, longitude)
     }
 
     try:
@@ -41,7 +113,7 @@ def call_yelp_ai(query: str, chat_id: str = None) -> dict:
         return {"error": f"API request failed: {str(e)}"}
 
 
-async def call_yelp_ai_async(query: str, chat_id: str = None) -> dict:
+async def call_yelp_ai_async(query: str, chat_id: str = None, latitude: float = None, longitude: float = None) -> dict:
     """Call Yelp AI Chat API v2 (asynchronous)"""
     url = "https://api.yelp.com/ai/chat/v2"
     headers = {
@@ -51,7 +123,7 @@ async def call_yelp_ai_async(query: str, chat_id: str = None) -> dict:
     data = {
         "query": query,
         "chat_id": chat_id if chat_id else "",
-        "user_context": {}
+        "user_context": build_user_context(latitude, longitude)
     }
 
     try:
@@ -59,10 +131,66 @@ async def call_yelp_ai_async(query: str, chat_id: str = None) -> dict:
             response = await client.post(url, headers=headers, json=data)
             response.raise_for_status()
             return response.json()
-    except httpx.RequestError as e:
+    except httpx.HTTPError as e:
         return {"error": f"API request failed: {str(e)}"}
 
 
+def get_yelp_chat_id(conversation_id: str) -> str | None:
+    """Get the Yelp chat_id stored for a conversation, if any"""
+    try:
+        response = supabase.table("conversations")\
+            .select("yelp_chat_id")\
+            .eq("id", conversation_id)\
+            .execute()
+    except Exception as e:
+        print(f"Error fetching Yelp chat_id: {e}")
+        return None
+
+    if response.data:
+        return response.data[0].get("yelp_chat_id")
+    return None
+
+
+def save_yelp_chat_id(conversation_id: str, yelp_response: dict, current_chat_id: str | None = None) -> str | None:
+    """Store the chat_id returned by Yelp so follow-ups reuse its server-side context"""
+    new_chat_id = yelp_response.get("chat_id") if isinstance(
+        yelp_response, dict) else None
+    if not new_chat_id or new_chat_id == current_chat_id:
+        return current_chat_id
+
+    try:
+        supabase.table("conversations").update({
+            "yelp_chat_id": new_chat_id
+        }).eq("id", conversation_id).execute()
+    except Exception as e:
+        print(f"Error saving Yelp chat_id: {e}")
+    return new_chat_id
+
+
+async def call_yelp_ai_in_conversation(conversation_id: str, query: str, latitude: float = None, longitude: float = None) -> dict:
+    """Call Yelp AI on the conversation's stored chat, starting a fresh chat if Yelp rejects it"""
+    chat_id = get_yelp_chat_id(conversation_id)
+    yelp_response = await call_yelp_ai_async(
+        query, chat_id=chat_id, latitude=latitude, longitude=longitude)
+
+    if chat_id and "error" in yelp_response:
+        print(f"Yelp rejected chat_id {chat_id}, retrying with a fresh chat")
+        yelp_response = await call_yelp_ai_async(
+            query, latitude=latitude, longitude=longitude)
+        if not yelp_response.get("chat_id"):
+            # Clear the stale id so later follow-ups don't keep resending it
+            try:
+                supabase.table("conversations").update({
+                    "yelp_chat_id": None
+                }).eq("id", conversation_id).execute()
+            except Exception as e:
+                print(f"Error clearing Yelp chat_id: {e}")
+            return yelp_response
+
+    save_yelp_chat_id(conversation_id, yelp_response, chat_id)
+    return yelp_response
+
+
 class UserLoginRequest(BaseModel):
     email: str
     password: str
@@ -83,8 +211,8 @@ class ChatRequest(BaseModel):
     user_id: str
     conversation_id: str
     message: str
-    latitude: float | None = None
-    longitude: float | None = None
+    latitude: float | None = Field(default=None, ge=-90, le=90)
+    longitude: float | None = Field(default=None, ge=-180, le=180)
 
 
 # Configure CORS
@@ -218,7 +346,7 @@ async def chat_endpoint(req: ChatRequest):
                 model="gpt-4o",
                 messages=[{
                     "role": "user",
-                    "content": f"Extract the origin city and destination city from this message. Return ONLY a JSON object with 'origin' and 'destination' keys. Message: {req.message}"
+                    "content": f"Extract the origin city and destination city from this message, and whether the origin is the user's current location (true/false). Return ONLY a JSON object with 'origin', 'destination' and 'is_current_location' keys. Message: {req.message}"
                 }],
                 response_format={"type": "json_object"}
             )
@@ -227,6 +355,11 @@ async def chat_endpoint(req: ChatRequest):
                 city_extract_response.choices[0].message.content)
             origin = cities.get("origin", "current location")
             destination = cities.get("destination", "new city")
+            # Only send the user's coordinates when they are in the origin city
+            if cities.get("is_current_location") is True:
+                origin_latitude, origin_longitude = req.latitude, req.longitude
+            else:
+                origin_latitude, origin_longitude = None, None
 
             # Make multiple Yelp API calls for comprehensive information
             print(
@@ -247,7 +380,8 @@ async def chat_endpoint(req: ChatRequest):
             print("Making parallel Yelp API calls...")
             movers_data, apartments_data, storage_data, cleaning_data, furniture_data, restaurants_data, activities_data = await asyncio.gather(
                 call_yelp_ai_async(
-                    f"Find me the top 3 moving companies in {origin}"),
+                    f"Find me the top 3 moving companies in {origin}",
+                    latitude=origin_latitude, longitude=origin_longitude),
                 call_yelp_ai_async(
                     f"Find me the top 3 apartments or housing options in {destination}"),
                 call_yelp_ai_async(
@@ -263,6 +397,9 @@ async def chat_endpoint(req: ChatRequest):
             )
             print("All Yelp API calls completed!")
 
+            # Seed the conversation's Yelp chat with the destination housing search
+            save_yelp_chat_id(req.conversation_id, apartments_data)
+
             # Create a concise summary for GPT-4o
             yelp_summary = f"""
 Movers in {origin}:
@@ -336,13 +473,14 @@ Use the Yelp data where relevant, but also provide general advice for each step.
                     "content": f"""Based on this conversation history and current question, extract:
 1. What type of business/service they're asking about
 2. What city/location (use context from previous messages if not specified)
+3. Whether that location is the user's current area, where they are moving from (true/false)
 
 Conversation context:
 {context_text}
 
 Current question: {req.message}
 
-Return ONLY a JSON object with 'business_type' and 'location' keys."""
+Return ONLY a JSON object with 'business_type', 'location' and 'is_current_location' keys."""
                 }],
                 response_format={"type": "json_object"}
             )
@@ -351,12 +489,21 @@ Return ONLY a JSON object with 'business_type' and 'location' keys."""
                 extract_response.choices[0].message.content)
             business_type = query_info.get("business_type", "businesses")
             location = query_info.get("location", "the area")
+            is_current_location = query_info.get(
+                "is_current_location") is True
 
             print(f"Searching Yelp for {business_type} in {location}")
 
             # Make targeted Yelp call (async)
             yelp_query = f"Find me the top 5 {business_type} in {location}"
-            yelp_response = await call_yelp_ai_async(yelp_query)
+            # Only send the user's coordinates when asking about their own area
+            if is_current_location:
+                yelp_response = await call_yelp_ai_in_conversation(
+                    req.conversation_id, yelp_query,
+                    latitude=req.latitude, longitude=req.longitude)
+            else:
+                yelp_response = await call_yelp_ai_in_conversation(
+                    req.conversation_id, yelp_query)
 
             # Extract Yelp data
             def extract_yelp_summary(yelp_response):
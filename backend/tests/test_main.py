@@ -0,0 +1,338 @@
+import os
+import asyncio
+import json
+import sys
+import types
+
+import httpx
+import pytest
+
+# Stub Supabase and provide a dummy OpenAI key so main can be imported offline
+sys.modules.setdefault(
+    "supabase_init", types.SimpleNamespace(supabase=None))
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+import main  # noqa: E402
+
+
+class FakeQuery:
+
+    def __init__(self, supabase, table):
+        self.supabase = supabase
+        self.table = table
+
+    def select(self, columns):
+        return self
+
+    def insert(self, values):
+        self.supabase.inserts.append((self.table, values))
+        return self
+
+    def update(self, values):
+        self.supabase.updates.append(values)
+        return self
+
+    def eq(self, column, value):
+        return self
+
+    def order(self, column, desc=False):
+        return self
+
+    def execute(self):
+        if self.supabase.error:
+            raise self.supabase.error
+        return types.SimpleNamespace(data=self.supabase.data.get(self.table, []))
+
+
+class FakeSupabase:
+
+    def __init__(self, data=None, error=None):
+        self.data = data or {}
+        self.error = error
+        self.inserts = []
+        self.updates = []
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+
+class FakeResponse:
+
+    def __init__(self, payload, status_code=200):
+        self.payload = payload
+        self.status_code = status_code
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            request = httpx.Request("POST", "https://api.yelp.com/ai/chat/v2")
+            raise httpx.HTTPStatusError(
+                "Yelp error", request=request,
+                response=httpx.Response(self.status_code, request=request))
+
+    def json(self):
+        return self.payload
+
+
+class FakeAsyncClient:
+    """Records Yelp request bodies and replays queued responses"""
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.requests = []
+
+    def __call__(self, *args, **kwargs):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    async def post(self, url, headers=None, json=None):
+        self.requests.append(json)
+        return self.responses.pop(0)
+
+
+class FakeOpenAI:
+    """Replays queued chat completion contents"""
+
+    def __init__(self, contents):
+        self.contents = contents
+        self.chat = types.SimpleNamespace(
+            completions=types.SimpleNamespace(create=self.create))
+
+    def create(self, **kwargs):
+        message = types.SimpleNamespace(content=self.contents.pop(0))
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)])
+
+
+class TestGeohash:
+
+    def test_encode_known_vector(self):
+        assert main.encode_geohash(57.64911, 10.40744, 11) == "u4pruydqqvj"
+
+    def test_decode_returns_cell_center(self):
+        geohash = main.encode_geohash(37.7749, -122.4194)
+        latitude, longitude = main.decode_geohash(geohash)
+
+        assert main.encode_geohash(latitude, longitude) == geohash
+        assert main.encode_geohash(
+            latitude, longitude, len(geohash) + 1)[:-1] == geohash
+        assert latitude == pytest.approx(37.7737, abs=1e-4)
+        assert longitude == pytest.approx(-122.4152, abs=1e-4)
+
+
+class TestBuildUserContext:
+
+    def test_missing_coordinate(self):
+        assert main.build_user_context() == {}
+        assert main.build_user_context(latitude=37.7749) == {}
+        assert main.build_user_context(longitude=-122.4194) == {}
+
+    def test_out_of_range_coordinates(self):
+        assert main.build_user_context(95, 200) == {}
+        assert main.build_user_context(37.7749, -200) == {}
+
+    def test_nearby_points_share_context(self):
+        context = main.build_user_context(37.7749, -122.4194)
+
+        assert set(context) == {"latitude", "longitude"}
+        assert context == main.build_user_context(37.7751, -122.4196)
+
+
+class TestSaveYelpChatId:
+
+    @pytest.fixture
+    def fake_supabase(self, monkeypatch):
+        fake = FakeSupabase()
+        monkeypatch.setattr(main, "supabase", fake)
+        return fake
+
+    def test_missing_chat_id(self, fake_supabase):
+        assert main.save_yelp_chat_id("conv", {}, "old") == "old"
+        assert main.save_yelp_chat_id("conv", {"error": "failed"}) is None
+        assert fake_supabase.updates == []
+
+    def test_unchanged_chat_id(self, fake_supabase):
+        assert main.save_yelp_chat_id(
+            "conv", {"chat_id": "same"}, "same") == "same"
+        assert fake_supabase.updates == []
+
+    def test_new_chat_id(self, fake_supabase):
+        assert main.save_yelp_chat_id(
+            "conv", {"chat_id": "new"}, "old") == "new"
+        assert fake_supabase.updates == [{"yelp_chat_id": "new"}]
+
+
+class TestGetYelpChatId:
+
+    def test_stored_chat_id(self, monkeypatch):
+        monkeypatch.setattr(main, "supabase", FakeSupabase(
+            {"conversations": [{"yelp_chat_id": "stored"}]}))
+        assert main.get_yelp_chat_id("conv") == "stored"
+
+    def test_missing_conversation(self, monkeypatch):
+        monkeypatch.setattr(main, "supabase", FakeSupabase())
+        assert main.get_yelp_chat_id("conv") is None
+
+    def test_soft_fail(self, monkeypatch):
+        monkeypatch.setattr(main, "supabase", FakeSupabase(
+            error=Exception("column does not exist")))
+        assert main.get_yelp_chat_id("conv") is None
+
+
+class TestCallYelpAiAsync:
+
+    def test_payload(self, monkeypatch):
+        client = FakeAsyncClient([FakeResponse({"chat_id": "abc"})])
+        monkeypatch.setattr(main.httpx, "AsyncClient", client)
+
+        response = asyncio.run(main.call_yelp_ai_async(
+            "Find me movers", chat_id="abc", latitude=37.7749, longitude=-122.4194))
+
+        assert response == {"chat_id": "abc"}
+        assert client.requests == [{
+            "query": "Find me movers",
+            "chat_id": "abc",
+            "user_context": main.build_user_context(37.7749, -122.4194)
+        }]
+
+    def test_payload_without_context(self, monkeypatch):
+        client = FakeAsyncClient([FakeResponse({})])
+        monkeypatch.setattr(main.httpx, "AsyncClient", client)
+
+        asyncio.run(main.call_yelp_ai_async("Find me movers"))
+
+        assert client.requests == [
+            {"query": "Find me movers", "chat_id": "", "user_context": {}}]
+
+    def test_http_error(self, monkeypatch):
+        client = FakeAsyncClient([FakeResponse({}, status_code=400)])
+        monkeypatch.setattr(main.httpx, "AsyncClient", client)
+
+        response = asyncio.run(main.call_yelp_ai_async("Find me movers"))
+
+        assert "error" in response
+
+
+class TestCallYelpAiInConversation:
+
+    def test_reuses_stored_chat_id(self, monkeypatch):
+        supabase = FakeSupabase({"conversations": [{"yelp_chat_id": "old"}]})
+        client = FakeAsyncClient([FakeResponse({"chat_id": "old"})])
+        monkeypatch.setattr(main, "supabase", supabase)
+        monkeypatch.setattr(main.httpx, "AsyncClient", client)
+
+        asyncio.run(main.call_yelp_ai_in_conversation("conv", "Find me movers"))
+
+        assert [request["chat_id"] for request in client.requests] == ["old"]
+        assert supabase.updates == []
+
+    def test_retries_rejected_chat_id(self, monkeypatch):
+        supabase = FakeSupabase({"conversations": [{"yelp_chat_id": "old"}]})
+        client = FakeAsyncClient([
+            FakeResponse({}, status_code=400),
+            FakeResponse({"chat_id": "new"})
+        ])
+        monkeypatch.setattr(main, "supabase", supabase)
+        monkeypatch.setattr(main.httpx, "AsyncClient", client)
+
+        response = asyncio.run(
+            main.call_yelp_ai_in_conversation("conv", "Find me movers"))
+
+        assert response == {"chat_id": "new"}
+        assert [request["chat_id"]
+                for request in client.requests] == ["old", ""]
+        assert supabase.updates == [{"yelp_chat_id": "new"}]
+
+    def test_clears_rejected_chat_id(self, monkeypatch):
+        supabase = FakeSupabase({"conversations": [{"yelp_chat_id": "old"}]})
+        client = FakeAsyncClient([
+            FakeResponse({}, status_code=400),
+            FakeResponse({}, status_code=500)
+        ])
+        monkeypatch.setattr(main, "supabase", supabase)
+        monkeypatch.setattr(main.httpx, "AsyncClient", client)
+
+        response = asyncio.run(
+            main.call_yelp_ai_in_conversation("conv", "Find me movers"))
+
+        assert "error" in response
+        assert supabase.updates == [{"yelp_chat_id": None}]
+
+
+class TestChatEndpoint:
+
+    history = [
+        {"role": "user", "content": "I'm moving from Chicago to Austin"},
+        {"role": "assistant", "content": "Here's your plan"}
+    ]
+
+    def run_chat(self, monkeypatch, message, gpt_contents, yelp_responses, history=history):
+        supabase = FakeSupabase({
+            "conversations": [{"yelp_chat_id": "stored"}],
+            "messages": history
+        })
+        client = FakeAsyncClient(yelp_responses)
+        monkeypatch.setattr(main, "supabase", supabase)
+        monkeypatch.setattr(main.httpx, "AsyncClient", client)
+        monkeypatch.setattr(main, "openai_client", FakeOpenAI(gpt_contents))
+
+        request = main.ChatRequest(
+            user_id="user", conversation_id="conv", message=message,
+            latitude=41.8781, longitude=-87.6298)
+        response = asyncio.run(main.chat_endpoint(request))
+        return response, client.requests
+
+    def test_follow_up_current_location(self, monkeypatch):
+        query_info = {"business_type": "storage facilities",
+                      "location": "Chicago", "is_current_location": True}
+        _, requests = self.run_chat(
+            monkeypatch, "Where can I find storage near me?",
+            [json.dumps(query_info), "Answer"],
+            [FakeResponse({"chat_id": "stored"})])
+
+        assert requests == [{
+            "query": "Find me the top 5 storage facilities in Chicago",
+            "chat_id": "stored",
+            "user_context": main.build_user_context(41.8781, -87.6298)
+        }]
+
+    def test_follow_up_other_location(self, monkeypatch):
+        query_info = {"business_type": "restaurants",
+                      "location": "Austin", "is_current_location": False}
+        _, requests = self.run_chat(
+            monkeypatch, "What about restaurants in Austin?",
+            [json.dumps(query_info), "Answer"],
+            [FakeResponse({"chat_id": "stored"})])
+
+        assert requests == [{
+            "query": "Find me the top 5 restaurants in Austin",
+            "chat_id": "stored",
+            "user_context": {}
+        }]
+
+    def run_initial_plan(self, monkeypatch, is_current_location):
+        cities = {"origin": "Chicago", "destination": "Austin",
+                  "is_current_location": is_current_location}
+        _, requests = self.run_chat(
+            monkeypatch, "I'm moving from Chicago to Austin",
+            [json.dumps(cities), "Plan", "Title"],
+            [FakeResponse({"chat_id": "new"}) for _ in range(7)],
+            history=[])
+        return {request["query"]: request["user_context"] for request in requests}
+
+    def test_initial_plan_origin_is_current_location(self, monkeypatch):
+        contexts = self.run_initial_plan(monkeypatch, True)
+
+        assert contexts["Find me the top 3 moving companies in Chicago"] == \
+            main.build_user_context(41.8781, -87.6298)
+        assert contexts["Find me the top 2 storage facilities in Chicago or Austin"] == {}
+        assert contexts["Find me the top 5 restaurants in Austin"] == {}
+
+    def test_initial_plan_origin_elsewhere(self, monkeypatch):
+        contexts = self.run_initial_plan(monkeypatch, False)
+
+        assert len(contexts) == 7
+        assert all(context == {} for context in contexts.values())